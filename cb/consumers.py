@@ -1,296 +1,408 @@
-import json
-import random
+import orjson
 import asyncio
-import time
+import sys
+from dataclasses import dataclass, field
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
 from cb.models import Room
-from cb.huffman_codec import encode_text, decode_text
+from cb.room_cache import forget_room, get_room_state, invalidate_room_cache
 from django.contrib.auth import get_user_model
+from django.db import transaction
 
 User = get_user_model()
 
-ROOM_USERS = {}      # { group_name: [username, ...] }
-ROOM_TIMERS = {}     # { group_name: asyncio.Task }
-LAST_SEEN = {}       # { (group_name, username): timestamp }
-REACTIONS = {}       # { group_name: {"likes": int, "dislikes": int} }
+ROOM_SHARD_COUNT = 16
+ROOM_DELETE_DELAY = 30     # seconds an empty room survives before it is deleted
+USER_LIST_DEBOUNCE = 0.05  # seconds to coalesce join/leave bursts into one user_event broadcast
+RECONNECT_GRACE = 3        # seconds a disconnected user stays listed, so a refresh isn't a leave + join
+REACTION_DEBOUNCE = 0.1    # seconds of likes/dislikes folded into one counts broadcast
+
+
+@dataclass(slots=True)
+class RoomState:
+    """Everything this process tracks for one room, reached with a single dict lookup."""
+
+    users: set = field(default_factory=set)
+    # asyncio.TimerHandle while the room sits empty, or the asyncio.Task once deletion runs.
+    timer: object = None
+    broadcast: asyncio.Task | None = None  # pending debounced user_event broadcast
+    presence: list = field(default_factory=list)  # encoded join/leave lines for that broadcast
+    user_list: tuple = ()                  # roster of the last user_event ...
+    users_json: bytes = b""                # ... and its encoded JSON array
+    pending_leaves: dict = field(default_factory=dict)  # {username: asyncio.TimerHandle}
+    likes: int = 0
+    dislikes: int = 0
+    reaction_flush: asyncio.Task | None = None  # pending debounced counts broadcast
+
+
+# Rooms are striped across shards; the shard lock only guards the deletion timer handoff.
+# Each shard: {"rooms": {group_name: RoomState}, "lock": asyncio.Lock}
+_SHARDS = [{"rooms": {}, "lock": asyncio.Lock()} for _ in range(ROOM_SHARD_COUNT)]
+
+
+def _shard(group_name):
+    return _SHARDS[hash(group_name) % ROOM_SHARD_COUNT]
+
+
+def _room_users(group_name):
+    state = _shard(group_name)["rooms"].get(group_name)
+    return state.users if state else ()
+
+
+def _announce(group_name, line):
+    """
+    Queue a join/leave line and broadcast it, together with the current roster, as one
+    user_event frame once membership settles for USER_LIST_DEBOUNCE.
+    """
+    state = _shard(group_name)["rooms"].get(group_name)
+    if state is None:
+        return
+    state.presence.append(line)
+    if state.broadcast is None:
+        state.broadcast = asyncio.create_task(_flush_user_event(group_name, state))
+
+
+def _user_event_payload(lines, users_json):
+    return b'{"type":"user_event","sys":[%s],"users":%s}' % (b",".join(lines), users_json)
+
+
+async def _flush_user_event(group_name, state):
+    await asyncio.sleep(USER_LIST_DEBOUNCE)
+    state.broadcast = None
+    lines, state.presence = state.presence, []
+    if not state.users:
+        return  # everyone left during the debounce; nobody to tell
+    users = tuple(sorted(state.users))
+    # Same roster as last time (e.g. a refresh) reuses the encoded array.
+    if users != state.user_list or not state.users_json:
+        state.user_list = users
+        state.users_json = orjson.dumps(users)
+    payload = _user_event_payload(lines, state.users_json)
+    await get_channel_layer().group_send(group_name, {"type": "user_event", "payload": payload})
+
+
+async def _flush_reactions(group_name, state):
+    await asyncio.sleep(REACTION_DEBOUNCE)
+    state.reaction_flush = None
+    payload = orjson.dumps(
+        {"type": "reaction_update", "likes": state.likes, "dislikes": state.dislikes}
+    )
+    await get_channel_layer().group_send(
+        group_name, {"type": "reaction_update", "payload": payload}
+    )
+
+
+def _finalize_leave(room_name, group_name, username):
+    """The user did not reconnect within RECONNECT_GRACE: drop them and announce it."""
+    state = _shard(group_name)["rooms"].get(group_name)
+    if state is None:
+        return
+    state.pending_leaves.pop(username, None)
+    state.users.discard(username)
+    if state.users:
+        _announce(group_name, _presence_line(username, _LEAVE_SUFFIX))
+        return
+    if state.timer:
+        state.timer.cancel()
+    # A plain TimerHandle: cancelling it on rejoin allocates no coroutine or task.
+    state.timer = asyncio.get_running_loop().call_later(
+        ROOM_DELETE_DELAY, _room_expired, room_name, group_name
+    )
+
+
+def _room_expired(room_name, group_name):
+    state = _shard(group_name)["rooms"].get(group_name)
+    if state is not None:
+        # Keep the deletion task in state.timer so a rejoin can still cancel it.
+        state.timer = asyncio.create_task(_delete_room(room_name, group_name))
+
+
+@database_sync_to_async
+def _delete_room_row(room_name):
+    # Build and run the QuerySet on the same worker thread.
+    Room.objects.filter(name=room_name).delete()
+    forget_room(room_name)
+
+
+async def _delete_room(room_name, group_name):
+    # Module-level on purpose: a pending deletion must not pin the last consumer in memory.
+    shard = _shard(group_name)
+    async with shard["lock"]:
+        state = shard["rooms"].get(group_name)
+        if state is None:
+            return
+        state.timer = None
+        if not state.users:
+            await _delete_room_row(room_name)
+            # Someone may have joined while the delete was in flight.
+            if not state.users:
+                shard["rooms"].pop(group_name, None)
+
+
+# Join/leave lines have a fixed shape, so only the username is spliced into a
+# pre-encoded JSON string. Django usernames are limited to letters, digits and
+# @.+-_, none of which need JSON escaping.
+_JOIN_SUFFIX = ' joined 👋"'.encode()
+_LEAVE_SUFFIX = ' left 👋"'.encode()
+
+
+def _presence_line(username, suffix):
+    return b'"' + username.encode() + suffix
+
+
+_MESSAGE_PREFIX = '{"message":"'
+_MESSAGE_PREFIX_LEN = len(_MESSAGE_PREFIX)
+
+
+def _plain_message(text_data):
+    """
+    Return the text of a bare {"message": "..."} frame, as sent by the chat box,
+    without a JSON parse. Returns None for any other frame, or one whose string
+    contains escapes, so the caller falls back to orjson.
+    """
+    if (
+        text_data
+        and text_data.startswith(_MESSAGE_PREFIX)
+        and text_data.endswith('"}')
+    ):
+        inner = text_data[_MESSAGE_PREFIX_LEN:-2]
+        # No backslash means nothing to unescape; no quote means it was the only field.
+        if "\\" not in inner and '"' not in inner:
+            return inner
+    return None
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
-    user_name = None
-    user_color = None
+    # Channels' base classes still give instances a __dict__ for the attributes they
+    # set; slots keep our own per-connection fields out of it.
+    __slots__ = ("room_name", "room_group_name", "user_name")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_name = None
 
     # ---------------------- Database Helpers ----------------------
 
-    @database_sync_to_async
-    def get_room(self, name):
-        try:
-            return Room.objects.get(name=name)
-        except Room.DoesNotExist:
+    async def load_room_state(self, room_name, username):
+        """
+        Return the lock flag and the user's allow-list membership, from one query
+        or, within ROOM_CACHE_TTL of the last one, from memory (see cb.room_cache).
+        """
+        state = await get_room_state(room_name)
+        if state is None:
             return None
+        is_locked, allowed = state
+        return {"is_locked": is_locked, "is_allowed": username in allowed}
 
     @database_sync_to_async
     def add_allowed_username(self, room_name, username):
-        room = Room.objects.get(name=room_name)
-        if not isinstance(room.allowed_usernames, list):
-            room.allowed_usernames = []
-
-        if username not in room.allowed_usernames:
-            room.allowed_usernames.append(username)
-            room.allowed_usernames = list(dict.fromkeys(room.allowed_usernames))
-            room.save()
-
-        try:
-            user = User.objects.get(username=username)
-            room.allowed_users.add(user)
-            room.save()
-        except User.DoesNotExist:
-            pass
-
-    @database_sync_to_async
-    def user_is_allowed(self, room_name, username):
-        try:
-            room = Room.objects.get(name=room_name)
-            allowed = room.allowed_usernames if isinstance(room.allowed_usernames, list) else []
-            return username in allowed
-        except Room.DoesNotExist:
-            return False
+        """
+        Allow-list a user joining an unlocked room and sync the M2M, in one thread hop.
+        Returns False if the room has been locked since connect read it.
+        """
+        # Row lock: concurrent joins would otherwise overwrite each other's append, and
+        # the lock flag read here can't change until the append commits.
+        with transaction.atomic():
+            room = (
+                Room.objects.select_for_update()
+                .only("is_locked", "allowed_usernames")
+                .get(name=room_name)
+            )
+            if room.is_locked:
+                return False
+            if not isinstance(room.allowed_usernames, list):
+                room.allowed_usernames = []
+
+            if username not in room.allowed_usernames:
+                room.allowed_usernames.append(username)
+                room.save(update_fields=["allowed_usernames"])
+
+            # One SELECT for every allowed account and one INSERT for the M2M rows.
+            usernames = [uname.strip().lower() for uname in room.allowed_usernames]
+            room.allowed_users.add(*User.objects.filter(username__in=usernames))
+        invalidate_room_cache(room_name)
+        return True
 
     @database_sync_to_async
     def lock_room_with_usernames(self, room_name, usernames):
-        try:
-            room = Room.objects.get(name=room_name)
-        except Room.DoesNotExist:
-            return False
-
-        if not isinstance(room.allowed_usernames, list):
-            room.allowed_usernames = []
-
-        normalized = [u.strip().lower() for u in usernames if u]
-        combined = list(dict.fromkeys(room.allowed_usernames + normalized))
-        room.allowed_usernames = combined
-        room.is_locked = True
-        room.save()
-
-        for uname in normalized:
-            try:
-                u = User.objects.get(username=uname)
-                room.allowed_users.add(u)
-            except User.DoesNotExist:
-                continue
-
-        room.save()
+        """Lock the room to `usernames`, which are already normalized by connect."""
+        with transaction.atomic():
+            # Only the allow-list is read; the lock flip itself is a single UPDATE.
+            room = (
+                Room.objects.select_for_update()
+                .only("allowed_usernames")
+                .filter(name=room_name)
+                .first()
+            )
+            if room is None:
+                return False
+
+            existing = room.allowed_usernames if isinstance(room.allowed_usernames, list) else []
+            known = set(existing)
+            added = [uname for uname in usernames if uname not in known]
+            if added:
+                Room.objects.filter(pk=room.pk).update(
+                    is_locked=True, allowed_usernames=existing + added
+                )
+            else:
+                # Everyone online is already allowed (the usual case): leave the list alone.
+                Room.objects.filter(pk=room.pk).update(is_locked=True)
+            room.allowed_users.add(*User.objects.filter(username__in=usernames))
+        invalidate_room_cache(room_name)
         return True
 
-    @database_sync_to_async
-    def sync_allowed_user_m2m(self, room_name):
-        try:
-            room = Room.objects.get(name=room_name)
-        except Room.DoesNotExist:
-            return
-
-        allowed_usernames = room.allowed_usernames if isinstance(room.allowed_usernames, list) else []
-        for uname in allowed_usernames:
-            try:
-                u = User.objects.get(username=uname.strip().lower())
-                room.allowed_users.add(u)
-            except User.DoesNotExist:
-                continue
-        room.save()
-
     # ---------------------- Connection Logic ----------------------
 
     async def connect(self):
         self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
-        self.room_group_name = f"chat_{self.room_name}"
+        # Interned so every consumer in the room shares one group-name string.
+        self.room_group_name = sys.intern(f"chat_{self.room_name}")
 
         user = self.scope["user"]
         if not user.is_authenticated:
             await self.close(code=403)
             return
 
-        room = await self.get_room(self.room_name)
+        # Normalized once here; everything downstream (room users, allow-lists) reuses it.
+        username = sys.intern(user.username.strip().lower())
+        room = await self.load_room_state(self.room_name, username)
         if not room:
             await self.close(code=404)
             return
 
-        await database_sync_to_async(room.refresh_from_db)()
-        username = user.username.strip().lower()
-        is_allowed = await self.user_is_allowed(self.room_name, username)
-
-        if room.is_locked and not is_allowed:
+        if room["is_locked"] and not room["is_allowed"]:
             await self.close(code=403)
             return
 
-        if not room.is_locked and not is_allowed:
-            await self.add_allowed_username(self.room_name, username)
-            await self.sync_allowed_user_m2m(self.room_name)
+        if not room["is_locked"] and not room["is_allowed"]:
+            # The room may have been locked after it was read; the row lock decides.
+            if not await self.add_allowed_username(self.room_name, username):
+                await self.close(code=403)
+                return
 
         self.user_name = username
-        self.user_color = random.choice(["#3498db", "#e67e22", "#2ecc71", "#9b59b6", "#e74c3c"])
-        LAST_SEEN[(self.room_group_name, self.user_name)] = time.time()
 
-        ROOM_USERS.setdefault(self.room_group_name, [])
-        if self.user_name not in ROOM_USERS[self.room_group_name]:
-            ROOM_USERS[self.room_group_name].append(self.user_name)
-
-        if self.room_group_name in ROOM_TIMERS:
-            ROOM_TIMERS[self.room_group_name].cancel()
-            del ROOM_TIMERS[self.room_group_name]
+        shard = _shard(self.room_group_name)
+        state = shard["rooms"].get(self.room_group_name)
+        if state is None:
+            state = shard["rooms"][self.room_group_name] = RoomState()
+        # Back within the grace period (e.g. a page refresh): the leave never happened.
+        pending_leave = state.pending_leaves.pop(self.user_name, None)
+        if pending_leave:
+            pending_leave.cancel()
+        # set.add/discard never yield, so membership updates need no lock; only the
+        # timer/delete transition below is serialized.
+        state.users.add(self.user_name)
+        async with shard["lock"]:
+            if state.timer:
+                state.timer.cancel()
+                state.timer = None
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
 
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {"type": "user_join", "user": self.user_name},
-        )
+        if pending_leave:
+            # Nobody saw us leave, so no join line; only this socket needs the roster.
+            users_json = orjson.dumps(sorted(state.users))
+            await self.send(bytes_data=_user_event_payload([], users_json))
+            return
+
+        line = _presence_line(self.user_name, _JOIN_SUFFIX)
+        if state.users == {self.user_name} and state.broadcast is None:
+            # Alone in the room: the frame is only for us, so skip the channel layer.
+            await self.send(bytes_data=_user_event_payload([line], orjson.dumps([self.user_name])))
+        else:
+            _announce(self.room_group_name, line)
 
     async def disconnect(self, close_code):
         if not self.user_name:
             return
 
-        last_seen = LAST_SEEN.get((self.room_group_name, self.user_name), 0)
-        if time.time() - last_seen < 3:
-            return
-
-        if self.room_group_name in ROOM_USERS and self.user_name in ROOM_USERS[self.room_group_name]:
-            ROOM_USERS[self.room_group_name].remove(self.user_name)
-
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {"type": "user_leave", "user": self.user_name},
-        )
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
-        if not ROOM_USERS.get(self.room_group_name):
-            ROOM_TIMERS[self.room_group_name] = asyncio.create_task(self.delete_room_after_timeout())
+        state = _shard(self.room_group_name)["rooms"].get(self.room_group_name)
+        if state is not None:
+            # Leave only if the user doesn't reconnect in time; connect cancels this.
+            pending_leave = state.pending_leaves.pop(self.user_name, None)
+            if pending_leave:
+                pending_leave.cancel()
+            state.pending_leaves[self.user_name] = asyncio.get_running_loop().call_later(
+                RECONNECT_GRACE, _finalize_leave, self.room_name, self.room_group_name, self.user_name
+            )
 
-    async def delete_room_after_timeout(self):
-        await asyncio.sleep(30)
-        if not ROOM_USERS.get(self.room_group_name):
-            await database_sync_to_async(Room.objects.filter(name=self.room_name).delete)()
-            ROOM_USERS.pop(self.room_group_name, None)
-            ROOM_TIMERS.pop(self.room_group_name, None)
+        # Drop per-user state so nothing keeps a closed connection's data alive.
+        self.user_name = None
 
     # ---------------------- Message Handling ----------------------
 
     async def receive(self, text_data):
-        data = json.loads(text_data)
-        message = data.get("message", "").strip()
-        command = data.get("command")
+        message = _plain_message(text_data)
+        data = orjson.loads(text_data) if message is None else {}
         reaction = data.get("reaction")
 
-        # ✅ Reactions
-        if reaction in ["like", "dislike"]:
-            REACTIONS.setdefault(self.room_group_name, {"likes": 0, "dislikes": 0})
+        # ✅ Reactions (checked first: the densest traffic, and it never needs the text)
+        if reaction in ("like", "dislike"):
+            state = _shard(self.room_group_name)["rooms"].get(self.room_group_name)
+            if state is None:
+                return
             if reaction == "like":
-                REACTIONS[self.room_group_name]["likes"] += 1
+                state.likes += 1
             else:
-                REACTIONS[self.room_group_name]["dislikes"] += 1
+                state.dislikes += 1
 
-            counts = REACTIONS[self.room_group_name]
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {"type": "reaction_update", **counts},
-            )
+            # A reaction storm becomes one counts snapshot per REACTION_DEBOUNCE window.
+            if state.reaction_flush is None:
+                state.reaction_flush = asyncio.create_task(
+                    _flush_reactions(self.room_group_name, state)
+                )
             return
 
         # ✅ Lock command
-        if command == "lock_room":
-            online_users = ROOM_USERS.get(self.room_group_name, [])
+        if data.get("command") == "lock_room":
+            online_users = sorted(_room_users(self.room_group_name))
             success = await self.lock_room_with_usernames(self.room_name, online_users)
             if success:
                 await self.channel_layer.group_send(
                     self.room_group_name,
                     {
                         "type": "system_message",
-                        "message": f"🔒 Room locked! Allowed: {', '.join(online_users)}",
+                        "payload": orjson.dumps(
+                            {
+                                "type": "system_message",
+                                "message": f"🔒 Room locked! Allowed: {', '.join(online_users)}",
+                            }
+                        ),
                     },
                 )
             return
 
         # ✅ Ignore empty
+        if message is None:
+            message = data.get("message", "")
+        message = message.strip()
         if not message:
             return
 
-        # ✅ Encode only if length > 2
-        if len(message) > 2:
-            encoded_msg, codes = encode_text(message)
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    "type": "chat_message",
-                    "message": encoded_msg,
-                    "codes": codes,
-                    "user": self.user_name,
-                    "color": self.user_color,
-                    "compressed": True,
-                },
-            )
-        else:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    "type": "chat_message",
-                    "message": message,
-                    "user": self.user_name,
-                    "color": self.user_color,
-                    "compressed": False,
-                },
-            )
+        # Encode the chat frame once here; every member forwards the same bytes.
+        # No color field: the room page derives each user's color from the name.
+        payload = orjson.dumps({"type": "chat", "message": message, "user": self.user_name})
+        await self.channel_layer.group_send(
+            self.room_group_name, {"type": "chat_message", "payload": payload}
+        )
 
     async def chat_message(self, event):
-        """Handle both encoded and normal messages."""
-        if event.get("compressed"):
-            decoded = decode_text(event["message"], event["codes"])
-        else:
-            decoded = event["message"]
-
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "chat",
-                    "message": decoded,
-                    "user": event["user"],
-                    "color": event["color"],
-                }
-            )
-        )
+        await self.send(bytes_data=event["payload"])
 
     async def reaction_update(self, event):
-        await self.send(text_data=json.dumps({"type": "reaction", **event}))
+        await self.send(bytes_data=event["payload"])
 
     # ---------------------- System Events ----------------------
 
     async def system_message(self, event):
-        await self.send(text_data=json.dumps(event))
-
-    async def user_join(self, event):
-        await self.send(
-            text_data=json.dumps(
-                {"type": "system", "user": "System", "message": f"{event['user']} joined 👋"}
-            )
-        )
-        await asyncio.sleep(0.1)
-        await self.update_all_user_lists()
-
-    async def user_leave(self, event):
-        await self.send(
-            text_data=json.dumps(
-                {"type": "system", "user": "System", "message": f"{event['user']} left 👋"}
-            )
-        )
-        await asyncio.sleep(0.1)
-        await self.update_all_user_lists()
-
-    # ---------------------- Online User List ----------------------
-
-    async def update_all_user_lists(self):
-        users = ROOM_USERS.get(self.room_group_name, [])
-        await self.channel_layer.group_send(
-            self.room_group_name, {"type": "broadcast_user_list", "users": users}
-        )
+        await self.send(bytes_data=event["payload"])
 
-    async def broadcast_user_list(self, event):
-        await self.send(text_data=json.dumps({"type": "user_list", "users": event["users"]}))
+    # Join/leave lines and the online-user list arrive together; the joining/leaving
+    # consumer schedules the broadcast and members only forward it.
+    async def user_event(self, event):
+        await self.send(bytes_data=event["payload"])
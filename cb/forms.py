@@ -3,6 +3,10 @@ from django.contrib.auth.models import User
 from django.conf import settings
 import requests
 
+RECAPTCHA_VERIFY_URL = "https://www.google.com/recaptcha/api/siteverify"
+# One pooled session so repeat verifications reuse the TLS connection to Google.
+_RECAPTCHA_SESSION = requests.Session()
+
 class UsernameUpdateForm(forms.ModelForm):
     class Meta:
         model = User
@@ -21,15 +25,24 @@ class UsernameUpdateForm(forms.ModelForm):
         if not token:
             raise forms.ValidationError("Please complete the reCAPTCHA")
 
-        response = requests.post(
-            "https://www.google.com/recaptcha/api/siteverify",
-            data={
-                "secret": settings.RECAPTCHA_SECRET_KEY,
-                "response": token
-            }
-        )
+        # The form is rejected anyway; don't spend a network round-trip (or the token).
+        if self.errors:
+            return cleaned_data
+
+        try:
+            response = _RECAPTCHA_SESSION.post(
+                RECAPTCHA_VERIFY_URL,
+                data={
+                    "secret": settings.RECAPTCHA_SECRET_KEY,
+                    "response": token
+                },
+                timeout=5,
+            )
+            success = response.json().get("success")
+        except (requests.RequestException, ValueError):
+            success = False
 
-        if not response.json().get("success"):
+        if not success:
             raise forms.ValidationError("Invalid reCAPTCHA")
 
         return cleaned_data
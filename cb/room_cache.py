@@ -0,0 +1,74 @@
+"""
+Short-lived in-process cache of each room's lock flag and allow-list, so a
+reconnect storm doesn't cost one SELECT per socket. Every write to either
+column must call invalidate_room_cache, and deleting the room forget_room.
+"""
+import itertools
+import time
+
+from channels.db import database_sync_to_async
+
+from cb.models import Room
+
+ROOM_CACHE_TTL = 5  # seconds a cached room row answers connects without a SELECT
+
+# { room_name: (expires_at, generation, is_locked, frozenset(allowed_usernames)) }
+_ROOM_CACHE = {}
+# { room_name: generation }, bumped by every invalidation. An entry only counts while its
+# generation is current, so a SELECT that raced a write can't bring the old row back.
+_ROOM_GENERATIONS = {}
+_next_generation = itertools.count(1).__next__
+# Generation of every room without an entry above. forget_room moves it on, so a
+# deleted room's SELECT still in flight doesn't look current once its entry is gone.
+_base_generation = 0
+
+
+def _generation(room_name):
+    return _ROOM_GENERATIONS.get(room_name, _base_generation)
+
+
+def invalidate_room_cache(room_name):
+    """Drop the cached row after any write to the room's lock flag or allow-list."""
+    _ROOM_GENERATIONS[room_name] = _next_generation()
+    _ROOM_CACHE.pop(room_name, None)
+
+
+def forget_room(room_name):
+    """Drop both entries of a deleted room, so dead room names don't pile up."""
+    global _base_generation
+    _base_generation = _next_generation()
+    _ROOM_GENERATIONS.pop(room_name, None)
+    _ROOM_CACHE.pop(room_name, None)
+
+
+@database_sync_to_async
+def _fetch_room_row(room_name):
+    return Room.objects.filter(name=room_name).values("is_locked", "allowed_usernames").first()
+
+
+async def get_room_state(room_name):
+    """
+    Return (is_locked, frozenset(allowed_usernames)) for the room, or None if it
+    doesn't exist.
+    """
+    generation = _generation(room_name)
+    cached = _ROOM_CACHE.get(room_name)
+    if cached is not None and (cached[0] < time.monotonic() or cached[1] != generation):
+        # Expired or superseded: evict it here rather than keep it until the next write.
+        _ROOM_CACHE.pop(room_name, None)
+        cached = None
+    if cached is None:
+        row = await _fetch_room_row(room_name)
+        if row is None:
+            return None
+        allowed = row["allowed_usernames"] if isinstance(row["allowed_usernames"], list) else []
+        cached = (
+            time.monotonic() + ROOM_CACHE_TTL,
+            generation,
+            row["is_locked"],
+            frozenset(allowed),
+        )
+        # Invalidated while the SELECT was in flight: use the row once, don't cache it.
+        if _generation(room_name) == generation:
+            _ROOM_CACHE[room_name] = cached
+    return cached[2], cached[3]
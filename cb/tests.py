@@ -1,3 +1,169 @@
-from django.test import TestCase
+import asyncio
+from unittest import mock
 
-# Create your tests here.
+import orjson
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from cb import consumers, room_cache
+from cb.models import Room
+from cb.routing import websocket_urlpatterns
+
+User = get_user_model()
+
+RECONNECT_GRACE = 0.2
+ROOM_DELETE_DELAY = 0.2
+# Long enough for a debounced user_event to be flushed and delivered.
+SETTLE = consumers.USER_LIST_DEBOUNCE + 0.1
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class ChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        for shard in consumers._SHARDS:
+            shard["rooms"].clear()
+        room_cache._ROOM_CACHE.clear()
+        room_cache._ROOM_GENERATIONS.clear()
+        for name, value in (
+            ("RECONNECT_GRACE", RECONNECT_GRACE),
+            ("ROOM_DELETE_DELAY", ROOM_DELETE_DELAY),
+        ):
+            patcher = mock.patch.object(consumers, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.alice = User.objects.create_user("alice", password="x")
+        self.bob = User.objects.create_user("bob", password="x")
+        Room.objects.create(name="lobby", created_by=self.alice)
+        self.app = URLRouter(websocket_urlpatterns)
+
+    async def join(self, user):
+        communicator = WebsocketCommunicator(self.app, "/ws/chat/lobby/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive(self, communicator):
+        output = await communicator.receive_output(timeout=1)
+        self.assertEqual(output["type"], "websocket.send")
+        return orjson.loads(output["bytes"])
+
+    async def join_both(self):
+        alice = await self.join(self.alice)
+        self.assertEqual(await self.receive(alice), {
+            "type": "user_event", "sys": ["alice joined 👋"], "users": ["alice"],
+        })
+        bob = await self.join(self.bob)
+        joined = {"type": "user_event", "sys": ["bob joined 👋"], "users": ["alice", "bob"]}
+        self.assertEqual(await self.receive(alice), joined)
+        self.assertEqual(await self.receive(bob), joined)
+        return alice, bob
+
+    async def test_refresh_within_grace_is_not_announced(self):
+        alice, bob = await self.join_both()
+
+        await bob.disconnect()
+        bob = await self.join(self.bob)
+
+        # Only the new socket gets the roster, with no join/leave line.
+        self.assertEqual(await self.receive(bob), {
+            "type": "user_event", "sys": [], "users": ["alice", "bob"],
+        })
+        await asyncio.sleep(RECONNECT_GRACE + SETTLE)
+        self.assertTrue(await alice.receive_nothing(timeout=0.05))
+        self.assertTrue(await bob.receive_nothing(timeout=0.05))
+
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_leave_is_announced_after_grace(self):
+        alice, bob = await self.join_both()
+
+        await bob.disconnect()
+        self.assertTrue(await alice.receive_nothing(timeout=RECONNECT_GRACE / 2))
+        self.assertEqual(await self.receive(alice), {
+            "type": "user_event", "sys": ["bob left 👋"], "users": ["alice"],
+        })
+
+        await alice.disconnect()
+
+    async def test_last_leave_deletes_the_room(self):
+        alice = await self.join(self.alice)
+        await self.receive(alice)
+
+        await alice.disconnect()
+        state = consumers._shard("chat_lobby")["rooms"]["chat_lobby"]
+        await asyncio.sleep(RECONNECT_GRACE + 0.05)
+        self.assertEqual(state.users, set())
+        self.assertIsNotNone(state.timer)
+
+        await asyncio.sleep(ROOM_DELETE_DELAY + 0.2)
+        self.assertFalse(await database_sync_to_async(Room.objects.filter(name="lobby").exists)())
+        self.assertNotIn("chat_lobby", consumers._shard("chat_lobby")["rooms"])
+
+    async def test_plain_message_frame_is_broadcast(self):
+        alice, bob = await self.join_both()
+
+        text = '{"message":"hello there"}'
+        self.assertEqual(consumers._plain_message(text), "hello there")
+        await alice.send_to(text_data=text)
+
+        chat = {"type": "chat", "message": "hello there", "user": "alice"}
+        self.assertEqual(await self.receive(alice), chat)
+        self.assertEqual(await self.receive(bob), chat)
+
+        await alice.disconnect()
+        await bob.disconnect()
+
+
+class PlainMessageTests(SimpleTestCase):
+    def test_falls_back_for_other_frames(self):
+        self.assertIsNone(consumers._plain_message('{"message":"say \\"hi\\""}'))
+        self.assertIsNone(consumers._plain_message('{"message":"hi","extra":"x"}'))
+        self.assertIsNone(consumers._plain_message('{"reaction":"like"}'))
+        self.assertIsNone(consumers._plain_message(""))
+
+
+class RoomCacheTests(TransactionTestCase):
+    def setUp(self):
+        room_cache._ROOM_CACHE.clear()
+        room_cache._ROOM_GENERATIONS.clear()
+        Room.objects.create(name="lobby", created_by=User.objects.create_user("alice", password="x"))
+
+    async def fetch_racing(self, write):
+        """Run get_room_state with `write` landing after its SELECT, before it caches."""
+        fetch = room_cache._fetch_room_row
+
+        async def racing_fetch(room_name):
+            row = await fetch(room_name)
+            await database_sync_to_async(write)()
+            return row
+
+        with mock.patch.object(room_cache, "_fetch_room_row", racing_fetch):
+            return await room_cache.get_room_state("lobby")
+
+    async def test_invalidation_during_fetch_is_not_cached(self):
+        def lock():
+            Room.objects.filter(name="lobby").update(is_locked=True)
+            room_cache.invalidate_room_cache("lobby")
+
+        # The row read before the write is used once ...
+        self.assertEqual(await self.fetch_racing(lock), (False, frozenset()))
+        self.assertNotIn("lobby", room_cache._ROOM_CACHE)
+        # ... and the next connect reads the locked row, which is then cached.
+        self.assertEqual(await room_cache.get_room_state("lobby"), (True, frozenset()))
+        self.assertIn("lobby", room_cache._ROOM_CACHE)
+
+    async def test_deletion_during_fetch_is_not_cached(self):
+        def delete():
+            Room.objects.filter(name="lobby").delete()
+            room_cache.forget_room("lobby")
+
+        self.assertEqual(await self.fetch_racing(delete), (False, frozenset()))
+        self.assertNotIn("lobby", room_cache._ROOM_CACHE)
+        self.assertIsNone(await room_cache.get_room_state("lobby"))
+        self.assertNotIn("lobby", room_cache._ROOM_GENERATIONS)
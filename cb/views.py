@@ -13,6 +13,7 @@ from django.urls import reverse
 from django.http import HttpResponseRedirect
 from django.db import connection
 from .forms import UsernameUpdateForm
+from .room_cache import invalidate_room_cache
 from django.http import JsonResponse
 import requests
 import random
@@ -65,21 +66,10 @@ class CustomLoginView(LoginView):
 
         return super().post(request, *args, **kwargs)
 
-# 🏗️ CREATE NEW ROOM
-@login_required(login_url="/login/")
-def create_room(request):
-    """Create a new chat room if it doesn't exist."""
-    if request.method == 'POST':
-        room_name = request.POST.get('room_name')
-        if room_name and not Room.objects.filter(name=room_name).exists():
-            Room.objects.create(name=room_name)
-        return redirect('room', room_name=room_name)
-    return redirect('index')
-
-
 @login_required
 def room(request, room_name):
-    room = Room.objects.get(name=room_name)
+    # created_by is compared here and again in the template; fetch it in the same query.
+    room = get_object_or_404(Room.objects.select_related("created_by"), name=room_name)
     username = request.user.username.strip().lower()
 
     # ✅ Use allowed_usernames (JSON) instead of M2M check
@@ -92,15 +82,21 @@ def room(request, room_name):
     return render(request, 'cb/room.html', {'room_name': room_name, 'room': room})
 
 
+# 🏗️ CREATE NEW ROOM
 @login_required
 def create_room(request):
+    """Create a new chat room if it doesn't exist."""
     if request.method == 'POST':
-        room_name = request.POST['room_name']
+        room_name = request.POST.get('room_name')
+        if not room_name:
+            return redirect('index')
+        # One statement against the unique index on name; no exists() + create() race.
         room, created = Room.objects.get_or_create(
             name=room_name,
             defaults={'created_by': request.user}  # ✅ save creator
         )
         return redirect('room', room_name=room_name)
+    return redirect('index')
 
 @login_required
 def toggle_lock(request, room_name):
@@ -109,6 +105,7 @@ def toggle_lock(request, room_name):
         if request.user == room.created_by:
             room.is_locked = not room.is_locked
             room.save()
+            invalidate_room_cache(room_name)
             return JsonResponse({"status": "success", "locked": room.is_locked})
         else:
             return JsonResponse({"status": "error", "message": "You are not allowed to lock this room."}, status=403)
@@ -66,6 +66,8 @@ DATABASES = {
     "default": dj_database_url.config(
         default=os.environ.get("DATABASE_URL"),
         conn_max_age=600,
+        # Persistent connections are checked before reuse instead of failing a request.
+        conn_health_checks=True,
         ssl_require=True
     )
 }
@@ -78,13 +80,38 @@ if not REDIS_URL:
 
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        # Pub/sub layer: each room group maps to one Redis channel, so a group_send is a
+        # single PUBLISH fanned out by Redis to every subscribed worker, rather than one
+        # list push per member channel as with the core layer.
+        "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
         "CONFIG": {
-            "hosts": [REDIS_URL],
+            # Extra keys are passed to the redis connection pool. The layer keeps its
+            # connections open; keepalive and health checks stop an idle link to a
+            # remote Redis from being dropped silently and reconnected mid-send.
+            "hosts": [
+                {
+                    "address": REDIS_URL,
+                    "socket_keepalive": True,
+                    "health_check_interval": 30,
+                }
+            ],
         },
     },
 }
 
+# Cache — the same Redis, used to keep session lookups off the database
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL,
+        "KEY_PREFIX": "cb",
+    },
+}
+
+# Sessions are read from Redis and written through to the database, so each HTTP
+# request and WebSocket connect skips the django_session SELECT.
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+
 # Auth redirects
 LOGIN_URL = "/login/"
 LOGIN_REDIRECT_URL = "/"   
@@ -110,12 +137,10 @@ SESSION_COOKIE_SECURE = True
 SESSION_COOKIE_SAMESITE = "None"
 CSRF_COOKIE_SAMESITE = "None"
 
-print("💾 DATABASE:", os.environ.get("DATABASE_URL"))
-
 # Localization
 LANGUAGE_CODE = "en-us"
 TIME_ZONE = "UTC"
-USE_I18N = True
+USE_I18N = False  # English-only UI; skips translation catalog loading and lookups
 USE_TZ = True
 
 STATIC_URL = "/static/"